@@ -1,7 +1,8 @@
 # app.py
 import io
 import csv
-from typing import List, Tuple, Dict, Any, Optional
+import codecs
+from typing import List, Tuple, Dict, Any, Optional, Iterable, Iterator
 import streamlit as st
 import pandas as pd
 
@@ -14,32 +15,39 @@ st.caption("Reads a messy Algal CSV line-by-line.")
 # ----------------------------
 # Helpers
 # ----------------------------
+# Substring checks search the whole row joined on this separator and lowercased once,
+# so the scan runs in C instead of a Python loop over the cells.
+# None of the tokens contain it, so a match can never span two cells.
+CELL_SEP = "\x1f"
+
 def normalize_cell(s: Optional[str]) -> str:
     if s is None:
         return ""
     return str(s).strip()
 
 def row_contains_all(row: List[str], required: List[str], case_insensitive=True, substring=False) -> bool:
-    cells = [normalize_cell(c) for c in row]
+    # Cells are normalized lazily, one at a time, so a row is never copied
     if case_insensitive:
-        cells_lookup = [c.lower() for c in cells]
+        cells_lookup = (normalize_cell(c).lower() for c in row)
         req = [r.lower() for r in required]
     else:
-        cells_lookup = cells
+        cells_lookup = (normalize_cell(c) for c in row)
         req = required
 
-    for token in req:
-        if substring:
-            if not any(token in c for c in cells_lookup):
-                return False
-        else:
-            if token not in cells_lookup:
-                return False
-    return True
+    if not substring:
+        if len(req) > 1:
+            cells_set = frozenset(cells_lookup)
+            return all(token in cells_set for token in req)
+        return all(token in cells_lookup for token in req)
+
+    row_text = CELL_SEP.join(row)
+    if case_insensitive:
+        row_text = row_text.lower()
+    return all(token in row_text for token in req)
 
 def row_contains_any_substring(row: List[str], tokens: List[str]) -> bool:
-    cells = [normalize_cell(c).lower() for c in row]
-    return any(any(tok.lower() in c for c in cells) for tok in tokens)
+    row_text = CELL_SEP.join(row).lower()
+    return any(tok.lower() in row_text for tok in tokens)
 
 def first_non_empty_row(rows: List[List[str]]) -> Optional[int]:
     for i, r in enumerate(rows):
@@ -53,220 +61,252 @@ def parse_metadata_pairs(row: List[str]) -> Dict[str, str]:
     Any trailing odd item without a pair is ignored.
     """
     cells = [normalize_cell(c) for c in row]
-    md = {}
-    for i in range(0, len(cells) - 1, 2):
-        k = cells[i]
-        v = cells[i + 1]
-        if k:
-            md[k] = v
+    md = dict(zip(cells[0::2], cells[1::2]))
+    md.pop("", None)  # pairs with an empty key are ignored
     return md
 
+# Output dtypes: repeated labels are stored as categoricals (dictionary encoded).
+# Measurements stay as the text that was read, so cells like '<0.1' or 'n/a' reach the downloads unchanged.
+CATEGORY_COLUMNS = ("Alga", "Taxon", "Station")
 
-def safe_number(x: str) -> Optional[float]:
-    x = normalize_cell(x)
-    if not x:
-        return None
-    # allow commas or stray symbols
-    x = x.replace(",", "")
-    try:
-        return float(x)
-    except ValueError:
-        return None
+def set_output_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the label columns of `df` to category, in place.
+    Columns are set by position because Table 1 headers can repeat (e.g. two 'Station' columns).
+    """
+    for i, col in enumerate(df.columns):
+        if col in CATEGORY_COLUMNS:
+            df.isetitem(i, df.iloc[:, i].astype("category"))
+    return df
 
 # ----------------------------
 # Line-by-line CSV loader (no pandas yet)
 # ----------------------------
-def read_csv_lines(file_bytes: bytes, encoding_guess="utf-8") -> List[List[str]]:
-    # Try the provided encoding first; fallback to latin-1
-    for enc in (encoding_guess, "utf-8-sig", "latin-1"):
-        try:
-            text = file_bytes.decode(enc)
-            break
-        except UnicodeDecodeError:
-            continue
-    reader = csv.reader(io.StringIO(text))
-    return [list(row) for row in reader]
+def read_csv_lines(file_bytes: bytes) -> Iterator[List[str]]:
+    # Sniff the BOM instead of trying encodings in turn: a UTF-8 BOM means utf-8-sig (which drops it),
+    # otherwise decode as utf-8 and fallback to latin-1, which cannot fail
+    enc = "utf-8-sig" if file_bytes.startswith(codecs.BOM_UTF8) else "utf-8"
+    try:
+        text = file_bytes.decode(enc)
+    except UnicodeDecodeError:
+        text = file_bytes.decode("latin-1")
+    # Rows are handed to the parser one at a time rather than loaded into a list first
+    return csv.reader(io.StringIO(text))
 
 # ----------------------------
 # Core parsing logic
 # ----------------------------
-def extract_sections(all_rows: List[List[str]]):
+# Parser states (single forward pass over the CSV rows)
+PRE_META = "PRE_META"              # rows above Table 1 (kept for the metadata)
+TABLE1_BODY = "TABLE1_BODY"        # reading Table 1 until 'Phyto' + 'Diversity:'
+SEEK_T2_HEADER = "SEEK_T2_HEADER"  # skipping rows until the Table 2 header
+TABLE2_BODY = "TABLE2_BODY"        # reading Table 2 until '===='
+SEEK_T3_HEADER = "SEEK_T3_HEADER"  # skipping rows until the Table 3 header
+TABLE3_BODY = "TABLE3_BODY"        # reading Table 3 until an all-empty row
+
+def extract_sections(all_rows: Iterable[List[str]]):
     """
+    Parses the rows in a single forward pass, so `all_rows` can be any iterable
+    of rows (e.g. the reader from read_csv_lines).
+
     Returns:
       metadata_dict, metadata_block_text, df1, df2, df3, df2_plus_df3
     """
-    # Normalize all rows to trimmed strings
-    rows = [[normalize_cell(c) for c in row] for row in all_rows]
+    # Cells are left as read and only normalized when they are compared or kept,
+    # so no second full copy of the file is built up front.
+    state = PRE_META
+    pre_rows: List[List[str]] = []
+    header1: List[str] = []
+    idx_taxon = None
+    data1_filtered: List[List[str]] = []
+    header_map: List[Optional[str]] = []
+    # Table 2 and Table 3 bodies are collected column by column, so the DataFrames
+    # are built straight from the columns with no row -> column transpose in pandas
+    data2: List[List[str]] = [[] for _ in range(5)]  # one list per keep_headers column
+    alga_col, mg_col, cells_units_col, ratio_col = [], [], [], []  # Table 3
 
-    # ---- Find Table 1 header ----
-    idx_table1_header = None
-    for i, r in enumerate(rows):
-        if row_contains_all(r, ["Taxon", "Station"], case_insensitive=True, substring=False):
-            idx_table1_header = i
-            break
+    # Truncate to the five key columns (Alga, mg/m^3, mg/m^3_%, Cells-units/L, Cells-units/L_%)
+    keep_headers = ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%"]
+    # Target for Table 2 (+ 'ratio') and Table 3 (after insertion): ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%", "ratio"]
+    t3_target_headers = ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%", "ratio"]
 
-    if idx_table1_header is None:
+    # Each state block either consumes the row (continue) or hands it on to the
+    # next state's block: the row that ends one table is also the first row
+    # searched for the next header.
+    for r in all_rows:
+
+        # ---- Find Table 1 header ----
+        if state == PRE_META:
+            if row_contains_all(r, ["Taxon", "Station"], case_insensitive=True, substring=False):
+                header1 = [c.strip() for c in r]
+                # Build a mapping of col name -> index for Table 1
+                for j, col in enumerate(header1):
+                    if col.lower() == "taxon":
+                        idx_taxon = j
+                        break
+                if idx_taxon is None:
+                    raise ValueError("Table 1 header located, but no 'Taxon' column was found.")
+                state = TABLE1_BODY
+            else:
+                # Everything above Table 1 header is kept for the metadata
+                pre_rows.append(r)
+            continue
+
+        # ---- Extract Table 1 ----
+        # Data for Table 1 goes until BEFORE a line containing both 'Phyto' and 'Diversity:'
+        if state == TABLE1_BODY:
+            if row_contains_all(r, ["Phyto", "Diversity:"], case_insensitive=True, substring=True):
+                state = SEEK_T2_HEADER  # stop before this row
+            else:
+                # Keep only rows where Taxon value is present
+                if idx_taxon < len(r) and r[idx_taxon].strip():
+                    data1_filtered.append([c.strip() for c in r])
+                continue
+
+        # ---- Extract Table 2 ----
+        # Look for header row like: ["", "mg/m^3", "%", " units or Cells/L", "%"]
+        # We'll match loosely: first cell empty-ish, contains mg/m^3, exact "%" at 3rd and 5th positions (loose), one header has "units or Cells/L"
+        if state == SEEK_T2_HEADER:
+            first_empty = (len(r) > 0 and r[0].strip() == "")
+            has_mg = has_units_or_cells = False
+            count_percents = 0
+            if first_empty:
+                # One pass over the cells sets all three flags, stopping as soon as they all hold
+                for c in r:
+                    if not c:
+                        continue
+                    lc = c.strip().lower()
+                    if lc == "mg/m^3":
+                        has_mg = True
+                    elif lc == "%":
+                        count_percents += 1
+                    elif "units or cells/l" in lc:
+                        has_units_or_cells = True
+                    if has_mg and has_units_or_cells and count_percents >= 2:
+                        break
+            if first_empty and has_mg and has_units_or_cells and count_percents >= 2:
+                # Normalize Table 2 headers as required
+                # Target headers: ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%", "ratio"]
+                # Note: we will add 'ratio' at the end; the table rows stop before the line containing '===='
+                t2_headers_raw = [c.strip() for c in r]
+                # Build normalized headers
+                t2_headers_norm = []
+                # We will scan and map according to the spec
+                # Expect roughly 5 first columns of interest
+                percent_seen = 0
+                for c in t2_headers_raw:
+                    lc = c.lower()
+                    if c == "" and len(t2_headers_norm) == 0:
+                        t2_headers_norm.append("Alga")
+                        header_map.append("Alga")
+                    elif lc == "mg/m^3":
+                        t2_headers_norm.append("mg/m^3")
+                        header_map.append("mg/m^3")
+                    elif c == "%":
+                        percent_seen += 1
+                        if percent_seen == 1:
+                            t2_headers_norm.append("mg/m^3_%")
+                            header_map.append("mg/m^3_%")
+                        else:
+                            t2_headers_norm.append("Cells-units/L_%")
+                            header_map.append("Cells-units/L_%")
+                    elif "units or cells/l" in lc:
+                        t2_headers_norm.append("Cells-units/L")
+                        header_map.append("Cells-units/L")
+                    else:
+                        # Anything else to the right will be dropped later per requirement
+                        header_map.append(None)
+
+                # header_map is fixed from here on, so resolve each kept column to its raw index once.
+                # When a name repeats, the right-most column wins; missing columns map to None and come out as "".
+                raw_idx_for = {col_name: raw_idx for raw_idx, col_name in enumerate(header_map) if col_name is not None}
+                keep_indices = [raw_idx_for.get(h) for h in keep_headers]
+                state = TABLE2_BODY
+            continue
+
+        # Collect Table 2 rows until BEFORE a line containing '===='
+        if state == TABLE2_BODY:
+            if row_contains_any_substring(r, ["===="]):
+                state = SEEK_T3_HEADER
+            else:
+                # Keep only the first 5 columns we care about, ordered as keep_headers
+                # (the empty ratio placeholder column is added when the DataFrame is built)
+                row_len = len(r)
+                for column, i in zip(data2, keep_indices):
+                    column.append(r[i].strip() if (i is not None and i < row_len) else "")
+                continue
+
+        # ---- Skip lines after '====' until Table 3 header ----
+        if state == SEEK_T3_HEADER:
+            # Match header: ["", "mg/m^3", "Cells-units/L", "ratio"]
+            row_lc = [c.strip().lower() for c in r]
+            row_set = frozenset(row_lc)
+            if (len(row_lc) >= 4 and
+                row_lc[0] == "" and
+                "mg/m^3" in row_set and
+                "cells-units/l" in row_set and
+                "ratio" in row_set):
+                state = TABLE3_BODY
+            continue
+
+        # ---- Extract Table 3 ----
+        # We'll read until an all-empty row or end of file
+        if state == TABLE3_BODY:
+            if not any(c.strip() for c in r):
+                break  # nothing after Table 3 is needed, stop reading
+            # Build mapping from the raw position:
+            # Expect raw columns in order: ["", "mg/m^3", "Cells-units/L", "ratio"]
+            # (the % columns are inserted as empty when the DataFrame is built)
+            row_len = len(r)
+            alga_col.append(r[0].strip() if row_len > 0 else "")
+            mg_col.append(r[1].strip() if row_len > 1 else "")
+            cells_units_col.append(r[2].strip() if row_len > 2 else "")
+            ratio_col.append(r[3].strip() if row_len > 3 else "")
+
+    if state == PRE_META:
         raise ValueError("Could not find Table 1 header row containing both 'Taxon' and 'Station'.")
+    if state == TABLE1_BODY or state == SEEK_T2_HEADER:
+        raise ValueError("Could not find Table 2 header row (empty, 'mg/m^3', '%', ' units or Cells/L', '%').")
+    if state == TABLE2_BODY or state == SEEK_T3_HEADER:
+        raise ValueError("Could not find Table 3 header row (empty, 'mg/m^3', 'Cells-units/L', 'ratio').")
 
     # ---- Metadata handling: everything above Table 1 header ----
-    pre_rows = rows[:idx_table1_header]
     md_row_idx = first_non_empty_row(pre_rows)
     metadata_dict = {}
     if md_row_idx is not None:
         metadata_dict = parse_metadata_pairs(pre_rows[md_row_idx])
 
     # Also keep a raw text block for all pre-table rows (useful for audit)
-    metadata_block_text = "\n".join([",".join(r) for r in pre_rows])
-
-    # ---- Extract Table 1 ----
-    header1 = rows[idx_table1_header]
-    # Build a mapping of col name -> index for Table 1
-    idx_taxon = None
-    for j, col in enumerate(header1):
-        if col.lower() == "taxon":
-            idx_taxon = j
-            break
-    if idx_taxon is None:
-        raise ValueError("Table 1 header located, but no 'Taxon' column was found.")
-
-    # Data for Table 1 goes until BEFORE a line containing both 'Phyto' and 'Diversity:'
-    data1: List[List[str]] = []
-    i = idx_table1_header + 1
-    while i < len(rows):
-        r = rows[i]
-        if row_contains_all(r, ["Phyto", "Diversity:"], case_insensitive=True, substring=True):
-            break  # stop before this row
-        data1.append(r)
-        i += 1
-
-    # Keep only rows where Taxon value is present
-    data1_filtered = [r for r in data1 if idx_taxon < len(r) and normalize_cell(r[idx_taxon])]
+    metadata_block_text = "\n".join(",".join(c.strip() for c in r) for r in pre_rows)
 
     # Convert Table 1 to DataFrame (align widths)
     width1 = max(len(header1), *(len(r) for r in data1_filtered)) if data1_filtered else len(header1)
     header1 = (header1 + [""] * (width1 - len(header1)))[:width1]
-    data1_filtered = [(r + [""] * (width1 - len(r)))[:width1] for r in data1_filtered]
-    df1 = pd.DataFrame(data1_filtered, columns=header1)
-
-    # ---- Extract Table 2 ----
-    # Look for header row like: ["", "mg/m^3", "%", " units or Cells/L", "%"]
-    # We'll match loosely: first cell empty-ish, contains mg/m^3, exact "%" at 3rd and 5th positions (loose), one header has "units or Cells/L"
-    idx_table2_header = None
-    for k in range(i, len(rows)):
-        r = rows[k]
-        first_empty = (len(r) > 0 and r[0] == "")
-        has_mg = any("mg/m^3" == c.lower() for c in r if c)
-        has_units_or_cells = any("units or cells/l" in c.lower() for c in r)
-        count_percents = sum(1 for c in r if c == "%")
-        if first_empty and has_mg and has_units_or_cells and count_percents >= 2:
-            idx_table2_header = k
-            break
-
-    if idx_table2_header is None:
-        raise ValueError("Could not find Table 2 header row (empty, 'mg/m^3', '%', ' units or Cells/L', '%').")
-
-    # Normalize Table 2 headers as required
-    # Target headers: ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%", "ratio"]
-    # Note: we will add 'ratio' at the end; the table rows stop before the line containing '===='
-    t2_headers_raw = rows[idx_table2_header]
-    # Build normalized headers
-    t2_headers_norm = []
-    # We will scan and map according to the spec
-    # Expect roughly 5 first columns of interest
-    header_map = []
-    percent_seen = 0
-    for c in t2_headers_raw:
-        lc = c.lower()
-        if c == "" and len(t2_headers_norm) == 0:
-            t2_headers_norm.append("Alga")
-            header_map.append("Alga")
-        elif lc == "mg/m^3":
-            t2_headers_norm.append("mg/m^3")
-            header_map.append("mg/m^3")
-        elif c == "%":
-            percent_seen += 1
-            if percent_seen == 1:
-                t2_headers_norm.append("mg/m^3_%")
-                header_map.append("mg/m^3_%")
-            else:
-                t2_headers_norm.append("Cells-units/L_%")
-                header_map.append("Cells-units/L_%")
-        elif "units or cells/l" in lc:
-            t2_headers_norm.append("Cells-units/L")
-            header_map.append("Cells-units/L")
-        else:
-            # Anything else to the right will be dropped later per requirement
-            header_map.append(None)
-
-    # Truncate to the five key columns (Alga, mg/m^3, mg/m^3_%, Cells-units/L, Cells-units/L_%)
-    keep_headers = ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%"]
-    t2_headers_final = keep_headers + ["ratio"]
-
-    # Collect Table 2 rows until BEFORE a line containing '===='
-    data2 = []
-    r_idx = idx_table2_header + 1
-    while r_idx < len(rows):
-        r = rows[r_idx]
-        if row_contains_any_substring(r, ["===="]):
-            break
-        # Build a trimmed row with only the first 5 columns we care about
-        trimmed = []
-        # Map current row cells by walking raw header_map
-        collected = {}
-        for raw_idx, col_name in enumerate(header_map):
-            if col_name in keep_headers:
-                val = rows[r_idx][raw_idx] if raw_idx < len(rows[r_idx]) else ""
-                collected[col_name] = val
-        trimmed = [collected.get(h, "") for h in keep_headers]
-        # Append ratio placeholder as empty
-        trimmed.append("")
-        data2.append(trimmed)
-        r_idx += 1
-
-    df2 = pd.DataFrame(data2, columns=t2_headers_final)
-
-    # ---- Skip lines after '====' until Table 3 header ----
-    idx_table3_header = None
-    for k in range(r_idx, len(rows)):
-        r = rows[k]
-        # Match header: ["", "mg/m^3", "Cells-units/L", "ratio"]
-        if (len(r) >= 4 and
-            r[0] == "" and
-            any(c.lower() == "mg/m^3" for c in r) and
-            any(c.lower() == "cells-units/l" for c in r) and
-            any(c.lower() == "ratio" for c in r)):
-            idx_table3_header = k
-            break
-
-    if idx_table3_header is None:
-        raise ValueError("Could not find Table 3 header row (empty, 'mg/m^3', 'Cells-units/L', 'ratio').")
-
-    # ---- Extract Table 3 ----
-    # Target (after insertion): ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%", "ratio"]
-    t3_target_headers = ["Alga", "mg/m^3", "mg/m^3_%", "Cells-units/L", "Cells-units/L_%", "ratio"]
-    data3 = []
-    k = idx_table3_header + 1
-    # We'll read until an all-empty row or end of file
-    while k < len(rows):
-        r = rows[k]
-        if not any(normalize_cell(c) for c in r):
-            break
-        # Build mapping from the raw position:
-        # Expect raw columns in order: ["", "mg/m^3", "Cells-units/L", "ratio"]
-        alga = r[0] if len(r) > 0 else ""
-        mg = r[1] if len(r) > 1 else ""
-        cells_units = r[2] if len(r) > 2 else ""
-        ratio = r[3] if len(r) > 3 else ""
-        row_out = [alga, mg, "", cells_units, "", ratio]  # Insert the % columns as empty
-        data3.append(row_out)
-        k += 1
-
-    df3 = pd.DataFrame(data3, columns=t3_target_headers)
+    # Pad short data rows in place (they are already our own stripped copies); none are wider than width1
+    for r in data1_filtered:
+        if len(r) < width1:
+            r.extend([""] * (width1 - len(r)))
+    df1 = set_output_dtypes(pd.DataFrame(data1_filtered, columns=header1))
 
     # ---- Concatenate Table 3 under Table 2 ----
-    # Ensure same columns/order
-    df2_aligned = df2[t3_target_headers] if list(df2.columns) != t3_target_headers else df2
-    df2_plus_df3 = pd.concat([df2_aligned, df3], ignore_index=True)
+    # Both tables share the t3_target_headers schema, so their column lists are
+    # concatenated and one DataFrame is built; df2 and df3 are row slices of it.
+    n2 = len(data2[0])
+    n3 = len(alga_col)
+    df2_plus_df3 = pd.DataFrame({
+        "Alga": data2[0] + alga_col,
+        "mg/m^3": data2[1] + mg_col,
+        "mg/m^3_%": data2[2] + [""] * n3,            # Insert the % columns as empty for Table 3
+        "Cells-units/L": data2[3] + cells_units_col,
+        "Cells-units/L_%": data2[4] + [""] * n3,
+        "ratio": [""] * n2 + ratio_col,              # ratio placeholder is empty for Table 2
+    }, columns=t3_target_headers, copy=False)
+    set_output_dtypes(df2_plus_df3)
+    # The row slices would otherwise share the combined category list; keep only each table's own labels
+    own_labels = {"Alga": lambda d: d["Alga"].cat.remove_unused_categories()}
+
+    df2 = df2_plus_df3.iloc[:n2].assign(**own_labels)
+    df3 = df2_plus_df3.iloc[n2:].reset_index(drop=True).assign(**own_labels)
 
     return metadata_dict, metadata_block_text, df1, df2, df3, df2_plus_df3
 
@@ -281,7 +321,7 @@ if not f:
     st.info("Upload a CSV to begin. The app parses it line-by-line and builds the outputs.")
     st.stop()
 
-# Read file as lines (no pandas yet)
+# Read file as a row iterator (no pandas yet)
 try:
     all_rows = read_csv_lines(f.read())
 except Exception as e:
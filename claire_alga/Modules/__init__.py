@@ -0,0 +1,2 @@
+# Parsing modules for the algae CSV app
+from .extract import extract_sections
@@ -1,21 +1,50 @@
 # app.py
 import io
 import csv
+import codecs
 import streamlit as st
 import pandas as pd
-import os
-import sys
 
 # Set page config
 st.set_page_config(page_title=None, page_icon="📖", layout="wide", initial_sidebar_state="expanded", menu_items=None)
 
-#Output Path
-path = os.path.dirname(os.path.abspath(__file__))
-#Add Modules
-sys.path.append(f'{path}/Modules') #adding the Modules directory to Python's search path at runtime.
-
 #Module Imports for the different sections
-import extract
+# Modules/ is a package next to this script (`streamlit run` puts the script's directory on sys.path)
+from Modules import extract_sections
+
+# ----------------------------
+# Reading & parsing helpers
+# ----------------------------
+def read_rows(raw_csv_as_bytes):
+    """
+    Decodes the upload and returns an iterator over its CSV rows (no pandas yet).
+    Rows are streamed straight into the parser rather than loaded into a list first.
+    """
+    # Sniff the BOM instead of trying encodings in turn: a UTF-8 BOM means utf-8-sig (which drops it),
+    # otherwise decode as utf-8 and fallback to latin-1, which cannot fail
+    enc = "utf-8-sig" if raw_csv_as_bytes.startswith(codecs.BOM_UTF8) else "utf-8"
+    try:
+        text = raw_csv_as_bytes.decode(enc)
+    except UnicodeDecodeError:
+        text = raw_csv_as_bytes.decode("latin-1")
+    return csv.reader(io.StringIO(text))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def parse_file(file_bytes):
+    """
+    Reads and parses an upload into (metadata_dict, df1, df2, df3, df2_plus_df3).
+    Cached on the file bytes, so reruns from widget interactions and downloads
+    reuse the parsed sections instead of parsing the whole file again.
+    """
+    return extract_sections(read_rows(file_bytes))
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def to_csv_bytes(df):
+    """
+    Encodes a table for its download button. Cached on the DataFrame, so reruns
+    reuse the bytes instead of formatting every cell with to_csv again.
+    """
+    return df.to_csv(index=False).encode("utf-8")
 
 st.title("Messy Algae CSV Parser")
 st.caption("Reads messy algal data CSV line-by-line and extracts: Metadata, Table 1, Table 2, Table 3 (then Table2 ⊕ Table3).")
@@ -33,30 +62,10 @@ if not f:
 
 
 # ----------------------------
-# Read file as lines (no pandas yet)
-# ----------------------------
-try:
-    raw_csv_as_bytes=f.read()
-    # Try the provided encoding first; fallback to latin-1
-    for enc in ("utf-8", "utf-8-sig", "latin-1"):
-        try:
-            text = raw_csv_as_bytes.decode(enc)
-            break
-        except UnicodeDecodeError:
-            continue
-    reader = csv.reader(io.StringIO(text))
-    list_of_rows= [list(row) for row in reader]
-
-except Exception as e:
-    st.error(f"Failed to read CSV: {e}")
-    st.stop()
-
-
-# ----------------------------
-# Parse into sections
+# Read & parse into sections (cached on the file contents)
 # ----------------------------
 try:
-    metadata_dict, df1, df2, df3, df2_plus_df3=extract.extract_sections(list_of_rows)
+    metadata_dict, df1, df2, df3, df2_plus_df3 = parse_file(f.getvalue())
 
 except Exception as e:
     st.error(f"Parsing error: {e}")
@@ -80,7 +89,7 @@ st.download_button("Download metadata.json", md_json, file_name="metadata.json",
 st.markdown(" ")
 st.markdown(" ##### Table 1 - Header row has 'Taxon' and 'Station', stops before the row with 'Phyto' and  'Diversity'")
 st.dataframe(df1, use_container_width=True)
-csv1 = io.BytesIO(df1.to_csv(index=False).encode("utf-8"))
+csv1 = io.BytesIO(to_csv_bytes(df1))
 st.download_button("Download table1.csv", csv1, file_name="table1.csv", mime="text/csv")
 
 # Table 2
@@ -88,21 +97,21 @@ st.markdown(" ")
 st.markdown(" ##### Table 2 -  Normalized headers, trimmed of additional rows to the left")
 st.caption("Stops before a line containing '===='. Header changes: empty→'Alga', 'units or Cells/L'→'Cells-units/L', '%'→'mg/m^3_%' and 'Cells-units/L_%'.")
 st.dataframe(df2, use_container_width=True)
-csv2 = io.BytesIO(df2.to_csv(index=False).encode("utf-8"))
+csv2 = io.BytesIO(to_csv_bytes(df2))
 st.download_button("Download table2.csv", csv2, file_name="table2.csv", mime="text/csv")
 
 # Table 3
 st.markdown(" ")
 st.markdown(" ##### Table 3 -  Headers ['', 'mg/m^3', 'Cells-units/L', 'ratio'] → insert '% columns to match Table 2")
 st.dataframe(df3, use_container_width=True)
-csv3 = io.BytesIO(df3.to_csv(index=False).encode("utf-8"))
+csv3 = io.BytesIO(to_csv_bytes(df3))
 st.download_button("Download table3.csv", csv3, file_name="table3.csv", mime="text/csv")
 
 # Combined
 st.markdown(" ")
 st.subheader("Combined: Table 2 ⊕ Table 3 (same schema)")
 st.dataframe(df2_plus_df3, use_container_width=True)
-csv23 = io.BytesIO(df2_plus_df3.to_csv(index=False).encode("utf-8"))
+csv23 = io.BytesIO(to_csv_bytes(df2_plus_df3))
 st.download_button("Download table2_plus_table3.csv", csv23, file_name="table2_plus_table3.csv", mime="text/csv")
 
 # Notes & next steps